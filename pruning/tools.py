@@ -75,15 +75,16 @@ def extract_kernels(dictionary):
 
 
 def set_kernel_masks_for_model(model, masks_dict, silent=False):
+    name2layer = {weight.name: layer
+                  for layer in model.layers for weight in layer.weights}
     for mask in masks_dict:
-        for layer in model.layers:
-            for weight in layer.weights:
-                if mask == weight.name:
-                    layer.set_pruning_mask(masks_dict[mask])
-                    if not silent:
-                        print(f"{weight.name:<32} pruning to "
-                              f"{layer.sparsity * 100:6.2f}%"
-                              f" (left {layer.left_unpruned})")
+        if mask in name2layer:
+            layer = name2layer[mask]
+            layer.set_pruning_mask(masks_dict[mask])
+            if not silent:
+                print(f"{mask:<32} pruning to "
+                      f"{layer.sparsity * 100:6.2f}%"
+                      f" (left {layer.left_unpruned})")
 
 
 def prune_l1(model, config, silent=False):
@@ -13,6 +13,10 @@ arg_parser.add_argument("--gpu",
                         default=0,
                         type=int,
                         help="Which GPU to use in case of multiple GPUs in the system")
+arg_parser.add_argument("--xla",
+                        default=1,
+                        type=int,
+                        help="Whether to compile the training step with XLA (0 or 1)")
 
 args, unknown_args = arg_parser.parse_known_args()
 print(f"UNKNOWN CMD ARGUMENTS: {unknown_args}")
@@ -21,6 +25,7 @@ print(f"  KNOWN CMD ARGUMENTS: {args.__dict__}")
 training.tools.set_visible_gpu([args.gpu])
 training.tools.set_memory_growth()
 training.tools.set_precision(32)
+training.tools.set_xla(bool(args.xla))
 
 with open(args.exp, 'r') as f:
     experiments = yaml.safe_load_all(f)
@@ -2,6 +2,15 @@ from collections.abc import Iterable
 
 import tensorflow as tf
 
+ACTIVATIONS = {
+    "tf.nn.relu": tf.nn.relu,
+    "tf.nn.relu6": tf.nn.relu6,
+    "tf.nn.elu": tf.nn.elu,
+    "tf.nn.selu": tf.nn.selu,
+    "tf.nn.swish": tf.nn.swish,
+    "tf.nn.leaky_relu": tf.nn.leaky_relu,
+}
+
 
 def classifier(
     flow,
@@ -12,35 +21,66 @@ def classifier(
     pooling="avgpool",
 ):
     if pooling == "catpool":
-        maxp = tf.keras.layers.GlobalMaxPool2D()(flow)
-        avgp = tf.keras.layers.GlobalAvgPool2D()(flow)
-        flow = tf.keras.layers.Concatenate()([maxp, avgp])
+        # both reductions in one expression, so XLA can fuse them into one pass
+        flow = tf.concat([tf.reduce_max(flow, axis=[1, 2]),
+                          tf.reduce_mean(flow, axis=[1, 2])], axis=-1)
     if pooling == "avgpool":
-        flow = tf.keras.layers.GlobalAvgPool2D()(flow)
+        flow = tf.keras.layers.GlobalAvgPool2D(data_format="channels_last")(flow)
     if pooling == "maxpool":
-        flow = tf.keras.layers.GlobalMaxPool2D()(flow)
+        flow = tf.keras.layers.GlobalMaxPool2D(data_format="channels_last")(flow)
 
+    dense_kwds = dict(
+        bias_regularizer=bias_regularizer,
+        kernel_regularizer=regularizer,
+        kernel_initializer=initializer,
+    )
+    if tf.keras.mixed_precision.global_policy().compute_dtype == "float16":
+        # keep logits fed to the loss in full precision
+        dense_kwds["dtype"] = "float32"
     # multiple-head version
     if isinstance(n_classes, Iterable):
-        outs = [
-            tf.keras.layers.Dense(
-                n_class,
-                bias_regularizer=bias_regularizer,
-                kernel_regularizer=regularizer,
-                kernel_initializer=initializer,
-            )(flow)
-            for n_class in n_classes
-        ]
+        outs = [tf.keras.layers.Dense(n_class, **dense_kwds)(flow)
+                for n_class in n_classes]
     else:
-        outs = tf.keras.layers.Dense(
-            n_classes,
-            bias_regularizer=bias_regularizer,
-            kernel_regularizer=regularizer,
-            kernel_initializer=initializer,
-        )(flow)
+        outs = tf.keras.layers.Dense(n_classes, **dense_kwds)(flow)
     return outs
 
 
+def conv(filters,
+         kernel_size,
+         initializer,
+         regularizer,
+         bias_regularizer,
+         use_bias=False,
+         **kwds):
+    return tf.keras.layers.Conv2D(
+        filters,
+        kernel_size,
+        padding="same",
+        data_format="channels_last",
+        use_bias=use_bias,
+        kernel_initializer=initializer,
+        kernel_regularizer=regularizer,
+        bias_regularizer=bias_regularizer,
+        **kwds,
+    )
+
+
+def bn_activate(x,
+                activation_func,
+                bn_regularizer,
+                momentum,
+                epsilon,
+                remove_relu=False):
+    # fused kernel has no float64 version, Keras raises if it is demanded
+    fused = tf.keras.mixed_precision.global_policy().compute_dtype != "float64"
+    x = tf.keras.layers.BatchNormalization(
+        beta_regularizer=bn_regularizer, gamma_regularizer=bn_regularizer,
+        momentum=momentum, epsilon=epsilon, fused=fused,
+    )(x)
+    return x if remove_relu else activation_func(x)
+
+
 def ResNetStiff(
     dataset=None,
     alias=None,
@@ -48,6 +88,7 @@ def ResNetStiff(
     n_classes=None,
     resnet_version=2,
     features=(16, 32, 64),
+    stem_features=16,
     l1_reg=0,
     l2_reg=2e-4,
     initializer="he_uniform",
@@ -81,128 +122,110 @@ def ResNetStiff(
         BLOCKS_IN_GROUP = size
         features = (16 * K, 32 * K, 64 * K),
 
-    activation_func = eval(activation)
+    assert len(features) == 3, f"features should have 3 widths, not {features}"
+
+    if tf.keras.mixed_precision.global_policy().compute_dtype == "float16":
+        # tensor cores are only used for channel counts divisible by 8
+        for width in (stem_features, *features):
+            assert width % 8 == 0, f"{width} channels with float16 policy!"
+
+    if activation not in ACTIVATIONS:
+        raise KeyError(f"ACTIVATION {activation} is unknown!")
+    activation_func = ACTIVATIONS[activation]
     if l2_reg or l1_reg:
         regularizer = tf.keras.regularizers.l1_l2(l1_reg, l2_reg)
     else:
         regularizer = None
     bias_regularizer = regularizer if regularize_bias else None
 
-    def conv(filters, kernel_size, use_bias=False, **kwds):
-        return tf.keras.layers.Conv2D(
-            filters,
-            kernel_size,
-            padding="same",
-            use_bias=use_bias,
-            kernel_initializer=initializer,
-            kernel_regularizer=regularizer,
-            bias_regularizer=bias_regularizer,
-            **kwds,
-        )
+    conv_kwds = dict(
+        initializer=initializer,
+        regularizer=regularizer,
+        bias_regularizer=bias_regularizer,
+    )
+    bn_kwds = dict(
+        activation_func=activation_func,
+        bn_regularizer=bias_regularizer,
+        momentum=BATCH_NORM_DECAY,
+        epsilon=BATCH_NORM_EPSILON,
+    )
 
     def shortcut(x, filters, strides):
         if not shortcut_conv_projection:
             m_filters = filters - x.shape[-1]
-            m_width = x.shape[1] // strides
-            m_height = x.shape[2] // strides
-            return tf.pad(
-                x[:, :m_width, :m_height], [[0, 0], [0, 0], [0, 0], [m_filters, 0]]
-            )
+            x = x[:, ::strides, ::strides]
+            shape = tf.shape(x)
+            zeros = tf.zeros([shape[0], shape[1], shape[2], m_filters], x.dtype)
+            return tf.concat([zeros, x], axis=-1)
         else:
             return tf.keras.layers.Conv2D(
                 filters,
                 kernel_size=1,
                 use_bias=False,
                 strides=strides,
+                data_format="channels_last",
                 kernel_initializer=initializer,
                 kernel_regularizer=regularizer,
             )(x)
 
-    def bn_activate(x, remove_relu=False):
-        x = tf.keras.layers.BatchNormalization(
-            beta_regularizer=bias_regularizer, gamma_regularizer=bias_regularizer,
-            momentum=BATCH_NORM_DECAY, epsilon=BATCH_NORM_EPSILON,
-        )(x)
-        return x if remove_relu else activation_func(x)
-
     def simple_block2(flow,
                       filters,
                       strides,
                       activate_shortcut=False):
         flow_shortcut = flow
-        flow = bn_activate(flow)
+        flow = bn_activate(flow, **bn_kwds)
         if activate_shortcut:
             flow_shortcut = flow
         if flow.shape[-1] != filters or strides != 1:
             flow_shortcut = shortcut(flow_shortcut, filters, strides)
 
-        flow = conv(filters, 3, strides=strides)(flow)
-        flow = bn_activate(flow)
+        flow = conv(filters, 3, strides=strides, **conv_kwds)(flow)
+        flow = bn_activate(flow, **bn_kwds)
 
         if dropout:
             flow = tf.keras.layers.Dropout(dropout)(flow)
-        flow = conv(filters, 3, strides=1)(flow)
+        flow = conv(filters, 3, strides=1, **conv_kwds)(flow)
         return flow + flow_shortcut
 
     def simple_block1(flow, filters, strides):
         flow_shortcut = flow
         if flow.shape[-1] != filters or strides != 1:
             flow_shortcut = shortcut(flow, filters, strides)
-            flow_shortcut = bn_activate(flow_shortcut, remove_relu=True)
+            flow_shortcut = bn_activate(flow_shortcut, remove_relu=True, **bn_kwds)
 
-        flow = conv(filters, 3, strides=strides)(flow)
-        flow = bn_activate(flow)
+        flow = conv(filters, 3, strides=strides, **conv_kwds)(flow)
+        flow = bn_activate(flow, **bn_kwds)
 
         if dropout:
             flow = tf.keras.layers.Dropout(dropout)(flow)
-        flow = conv(filters, 3, strides=1)(flow)
-        flow = bn_activate(flow, remove_relu=True)
+        flow = conv(filters, 3, strides=1, **conv_kwds)(flow)
+        flow = bn_activate(flow, remove_relu=True, **bn_kwds)
         return activation_func(flow + flow_shortcut)
 
+    def group(flow, block, filters, strides, **kwds):
+        flow = block(flow, filters=filters, strides=strides, **kwds)
+        for _ in range(BLOCKS_IN_GROUP - 1):
+            flow = block(flow, filters=filters, strides=1)
+        return flow
+
     inputs = tf.keras.Input(input_shape)
     flow = inputs
 
-    flow = conv(16, 3, strides=1, use_bias=False)(flow)
+    flow = conv(stem_features, 3, strides=1, use_bias=False, **conv_kwds)(flow)
 
     if resnet_version == 2:
-        flow = simple_block2(flow,
-                             filters=features[0],
-                             strides=1,
-                             activate_shortcut=True)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block2(flow, filters=features[0], strides=1)
-
-        flow = simple_block2(flow,
-                             filters=features[1],
-                             strides=2,
-                             activate_shortcut=True)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block2(flow, filters=features[1], strides=1)
+        for filters, strides in zip(features, (1, 2, 2)):
+            flow = group(flow, simple_block2, filters, strides,
+                         activate_shortcut=True)
 
-        flow = simple_block2(flow,
-                             filters=features[2],
-                             strides=2,
-                             activate_shortcut=True)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block2(flow, filters=features[2], strides=1)
-
-        flow = bn_activate(flow, remove_relu=True)
+        flow = bn_activate(flow, remove_relu=True, **bn_kwds)
         flow = tf.nn.relu(flow)
 
     elif resnet_version == 1:
-        flow = bn_activate(flow)
-
-        flow = simple_block1(flow, filters=features[0], strides=1)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block1(flow, filters=features[0], strides=1)
+        flow = bn_activate(flow, **bn_kwds)
 
-        flow = simple_block1(flow, filters=features[1], strides=2)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block1(flow, filters=features[1], strides=1)
-
-        flow = simple_block1(flow, filters=features[2], strides=2)
-        for _ in range(BLOCKS_IN_GROUP - 1):
-            flow = simple_block1(flow, filters=features[2], strides=1)
+        for filters, strides in zip(features, (1, 2, 2)):
+            flow = group(flow, simple_block1, filters, strides)
 
     outputs = classifier(
         flow,
@@ -37,9 +37,16 @@ def run_experiment(exp):
 
     lr_metric = training.tools.get_optimizer_lr_metric(optimizer)
     metrics = ["accuracy", lr_metric]
+    if tf.keras.mixed_precision.global_policy().name == "mixed_float16":
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
     model.compile(optimizer, loss_fn, metrics=metrics)
     training.tools.print_model_info(model)
 
+    # untrained weights, cheaper to restore than rebuilding a fresh model
+    initial_weights = None
+    if exp.get('load_model_after_pruning') == 'random':
+        initial_weights = training.tools.snapshot_weights(model)
+
     # load checkpointed all weights before the pruning
     if exp.get('load_model_before_pruning'):
         model.load_weights(exp['load_model_before_pruning'])
@@ -55,13 +62,16 @@ def run_experiment(exp):
     if exp.get('load_model_after_pruning'):
         path = exp['load_model_after_pruning']
         if path == 'random':
-            ckp = None
+            num_masks = training.tools.restore_weights(
+                model,
+                initial_weights,
+                skip_keyword='kernel_mask')
+            del initial_weights
         else:
-            ckp = path
-        num_masks = training.tools.reset_weights_to_checkpoint(
-            model,
-            ckp=ckp,
-            skip_keyword='kernel_mask')
+            num_masks = training.tools.reset_weights_to_checkpoint(
+                model,
+                ckp=path,
+                skip_keyword='kernel_mask')
         print(f"LOADED AFTER PRUNING {path}, but keeping {num_masks} masks")
 
     checkpoint_callback = training.tools.CheckpointAfterEpoch(
@@ -1,5 +1,5 @@
+import concurrent.futures
 import os
-import pickle
 import random
 from collections import Counter
 
@@ -21,7 +21,7 @@ def set_visible_gpu(gpus=()):
 
 
 def set_precision(precision):
-    import tensorflow.keras.mixed_precision.experimental as mixed_precision
+    from tensorflow.keras import mixed_precision
 
     print(f"SETTING PRECISION TO {precision}")
     if precision == 16:
@@ -32,7 +32,12 @@ def set_precision(precision):
         policy = mixed_precision.Policy('float64')
     else:
         raise NameError(f"Available precision: 16, 32, 64. Not {precision}!")
-    mixed_precision.set_policy(policy)
+    mixed_precision.set_global_policy(policy)
+
+
+def set_xla(enabled=True):
+    print(f"SETTING XLA JIT TO {enabled}")
+    tf.config.optimizer.set_jit(enabled)
 
 
 def log_from_history(history, exp):
@@ -57,39 +62,97 @@ def log_from_history(history, exp):
     if exp.get('tensorboard'):
         rnd_idx = random.randint(10000, 99999)
         path = os.path.join(exp['tensorboard'], str(rnd_idx))
-        writer = tf.summary.create_file_writer(path)
+        # queue all records in memory and write them to the file at once
+        num_records = sum(len(values) for values in history.values()) + 1
+        writer = tf.summary.create_file_writer(path, max_queue=num_records)
         with writer.as_default():
             for key in history:
                 for idx, value in enumerate(history[key]):
                     tf.summary.scalar(key, value, idx + 1)
             tf.summary.text("experiment", data=str(exp), step=0)
+        writer.flush()
+        writer.close()
     return exp
 
 
+def _assign_all(variables, values):
+    for variable, value in zip(variables, values):
+        variable.assign(value)
+
+
+def set_all_weights_from_model(model, source_model):
+    """Copy weights in place from a model with the same structure."""
+
+    assert len(model.weights) == len(source_model.weights)
+    _assign_all(model.weights, source_model.weights)
+
+
+def checkpoint_has_optimizer(ckp):
+    """True for TF format checkpoints that also store an optimizer."""
+
+    try:
+        names = [name for name, _ in tf.train.list_variables(ckp)]
+    except (tf.errors.NotFoundError, tf.errors.DataLossError):
+        return False  # HDF5 weights never contain the optimizer
+    return any(name.startswith("optimizer/") for name in names)
+
+
+def snapshot_weights(model):
+    return [w.numpy() for w in model.weights]
+
+
+def restore_weights(model, snapshot, skip_keyword=None):
+    """Restore network in place from a list of values, can skip keyword."""
+
+    assert len(model.weights) == len(snapshot)
+    variables = []
+    values = []
+    for w, value in zip(model.weights, snapshot):
+        if skip_keyword and skip_keyword in w.name:
+            continue
+        variables.append(w)
+        values.append(value)
+    _assign_all(variables, values)
+    return len(model.weights) - len(variables)
+
+
 def reset_weights_to_checkpoint(model, ckp=None, skip_keyword=None):
     """Reset network in place, has an ability to skip keybword."""
 
-    temp = tf.keras.models.clone_model(model)
+    kept = [w for w in model.weights if skip_keyword and skip_keyword in w.name]
+    skipped = len(kept)
     if ckp:
-        temp.load_weights(ckp)
-    skipped = 0
-    for w1, w2 in zip(model.weights, temp.weights):
-        if skip_keyword and skip_keyword in w1.name:
-            skipped += 1
-            continue
-        w1.assign(w2)
+        # load straight into the model and put back only the skipped weights
+        # it would overwrite iterations and slots of the live optimizer
+        assert not checkpoint_has_optimizer(ckp), f"{ckp} has optimizer!"
+        kept_values = [w.numpy() for w in kept]
+        model.load_weights(ckp)
+        _assign_all(kept, kept_values)
+    else:
+        temp = tf.keras.models.clone_model(model)
+        restore_weights(model, temp.weights, skip_keyword=skip_keyword)
     print(f"INFO RESET: Skipped {skipped} layers with keyword {skip_keyword}!")
     return skipped
 
 
 def concatenate_flattened(arrays):
-    return np.concatenate([x.flatten() if isinstance(x, np.ndarray)
-                           else x.numpy().flatten() for x in arrays], axis=0)
+    arrays = [x if isinstance(x, np.ndarray) else x.numpy() for x in arrays]
+    result = np.empty(sum(x.size for x in arrays),
+                      dtype=np.result_type(*arrays))
+    offset = 0
+    for x in arrays:
+        np.copyto(result[offset:offset + x.size], x.ravel())
+        offset += x.size
+    return result
 
 
-def print_model_info(model):
-    print(f"MODEL INFO")
+def get_summary_stats(model):
+    """Count layers and parameters of the model in one pass over its layers."""
+
     layer_counts = Counter()
+    bn = 0
+    biases = 0
+    kernels = 0
     for layer in model.layers:
         if isinstance(layer, tf.keras.layers.Dense):
             layer_counts['Dense'] += 1
@@ -99,17 +162,7 @@ def print_model_info(model):
             layer_counts['BatchNorm'] += 1
         if isinstance(layer, tf.keras.layers.Dropout):
             layer_counts['Dropout'] += 1
-    print(f"LAYER COUNTS: {dict(layer_counts)}")
 
-    bn = 0
-    biases = 0
-    kernels = 0
-    trainable_w = 0
-    for w in model.trainable_weights:
-        n = w.shape.num_elements()
-        trainable_w += n
-
-    for layer in model.layers:
         if hasattr(layer, 'beta') and layer.beta is not None:
             bn += layer.beta.shape.num_elements()
 
@@ -122,23 +175,36 @@ def print_model_info(model):
         if hasattr(layer, 'kernel'):
             kernels += layer.kernel.shape.num_elements()
 
-    print(f"TRAINABLE WEIGHTS: {trainable_w}")
-    print(f"KERNELS: {kernels} ({kernels / trainable_w * 100:^6.2f}%), "
-          f"BIASES: {biases} ({biases / trainable_w * 100:^6.2f}%), "
-          f"BN: {bn} ({bn / trainable_w * 100:^6.2f}%)")
+    trainable_w = sum(w.shape.num_elements() for w in model.trainable_weights)
+    return {
+        'layer_counts': dict(layer_counts),
+        'trainable': trainable_w,
+        'kernels': kernels,
+        'biases': biases,
+        'bn': bn,
+    }
+
+
+def print_model_info(model):
+    print(f"MODEL INFO")
+    stats = get_summary_stats(model)
+    print(f"LAYER COUNTS: {stats['layer_counts']}")
+    print(f"TRAINABLE WEIGHTS: {stats['trainable']}")
+    print(", ".join(f"{key.upper()}: {stats[key]} "
+                    f"({stats[key] / stats['trainable'] * 100:^6.2f}%)"
+                    for key in ('kernels', 'biases', 'bn')))
 
 
 def save_optimizer(optimizer, path):
     if dirpath := os.path.dirname(path):
-        os.makedirs(dirpath, exist_ok=True)
-    weights = optimizer.get_weights()
-    with open(path, 'wb') as f:
-        pickle.dump(weights, f)
+        tf.io.gfile.makedirs(dirpath)
+    tf.train.Checkpoint(optimizer=optimizer).write(path)
 
 
 def save_model(model, path):
     if dirpath := os.path.dirname(path):
-        os.makedirs(dirpath, exist_ok=True)
+        tf.io.gfile.makedirs(dirpath)
+    # HDF5 regardless of the extension, TF format would also save the optimizer
     model.save_weights(path, save_format="h5")
 
 
@@ -155,12 +221,46 @@ class CheckpointAfterEpoch(tf.keras.callbacks.Callback):
         self.created_model_ckp = []
         self.created_optim_ckp = []
 
+        # model checkpoints are written in background from a shadow copy
+        self._executor = None
+        self._pending = None
+        self._shadow_model = None
+
+    def set_model(self, model):
+        if model is not self.model:
+            self._wait_for_pending()
+            self._shadow_model = None
+        super().set_model(model)
+
+    def _wait_for_pending(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def _close(self):
+        self._wait_for_pending()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
     def on_epoch_end(self, epoch, logs=None):
         next_epoch = epoch + 1
 
         if next_epoch in self.epoch2path:
             path = self.epoch2path[next_epoch]
-            save_model(self.model, path)
+            self._wait_for_pending()
+            if self._shadow_model is None:
+                # kept in host memory, not as a second copy on the device
+                # must stay uncompiled, so no optimizer state ends up saved
+                with tf.device('/cpu:0'):
+                    self._shadow_model = tf.keras.models.clone_model(self.model)
+            # snapshot synchronously, training will keep updating the weights
+            set_all_weights_from_model(self._shadow_model, self.model)
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1)
+            self._pending = self._executor.submit(
+                save_model, self._shadow_model, path)
             self.created_model_ckp.append(path)
 
         if next_epoch in self.epoch2path_optim:
@@ -168,7 +268,11 @@ class CheckpointAfterEpoch(tf.keras.callbacks.Callback):
             save_optimizer(self.model.optimizer, path)
             self.created_optim_ckp.append(path)
 
+    def on_train_end(self, logs=None):
+        self._close()
+
     def list_created_checkpoints(self):
+        self._close()
         print(f"CREATED MODEL CHECKPOINTS:")
         for ckp in self.created_model_ckp:
             print(ckp)